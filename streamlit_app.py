@@ -1,12 +1,23 @@
+import html
 import io
 import logging
 import re
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+
 import anthropic
-from urllib.parse import urlparse, parse_qs
+import requests
+from requests.adapters import HTTPAdapter
+from xml.sax.saxutils import escape
 
+import docx
 import streamlit as st
+from diskcache import Cache
 from docx import Document
-from docx.shared import Pt, RGBColor
+from docx.document import Document as DocxDocument
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.styles import ParagraphStyle
@@ -29,6 +40,31 @@ logger = logging.getLogger(__name__)
 # Register built-in Japanese CID font once at module load
 pdfmetrics.registerFont(UnicodeCIDFont("HeiseiMin-W3"))
 
+# ── Cache ─────────────────────────────────────────────────────────────────────
+# Persistent on-disk cache so repeat runs of the same video skip YouTube entirely.
+# Opened once per process and kept next to the app, independent of the CWD.
+@st.cache_resource
+def _transcript_cache() -> Cache:
+    return Cache(Path(__file__).parent / ".transcript_cache")
+
+
+cache = _transcript_cache()
+TRANSCRIPT_TTL = 7 * 86400
+LANGUAGES_TTL = 86400
+TITLE_TTL = 86400
+
+HTTP_TIMEOUT = (3, 10)  # (connect, read) seconds
+
+
+# One session per process so title lookups reuse the TCP/TLS connection across reruns
+@st.cache_resource
+def _http_session() -> requests.Session:
+    session = requests.Session()
+    session.headers.update({"User-Agent": "Mozilla/5.0", "Accept-Language": "en"})
+    session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+    return session
+
 # ── Secrets ───────────────────────────────────────────────────────────────────
 
 def _secret(key: str) -> str:
@@ -39,19 +75,29 @@ def _secret(key: str) -> str:
 
 # ── YouTube helpers ───────────────────────────────────────────────────────────
 
+# Matches watch, youtu.be, embed, shorts, live and /v/ URLs, or a bare 11-char video ID.
+# The host must open the URL (after an optional scheme; any youtube.com subdomain such
+# as www., m. or music.), and the ID must end at a URL delimiter so longer or
+# malformed values are rejected, not truncated.
+_VIDEO_ID_RE = re.compile(
+    r"^(?:https?://)?"
+    r"(?:(?:www\.)?youtu\.be/|(?:[\w-]+\.)*youtube\.com/(?:watch/?\?(?:[^&#]*&)*v=|embed/|shorts/|live/|v/))"
+    r"([0-9A-Za-z_-]{11})(?![^?&#/])"
+    r"|^([0-9A-Za-z_-]{11})$"
+)
+_ILLEGAL_FN_CHARS = frozenset('\\/*?:"<>|')
+_FN_SANITIZE = str.maketrans(dict.fromkeys(_ILLEGAL_FN_CHARS, "_"))
+_TITLE_RE = re.compile(r"<title>(.*?)</title>", re.DOTALL)
+_TITLE_SCAN_LIMIT = 256 * 1024  # give up on pages with no <title> this far in
+
+
 def extract_video_id(url: str) -> str:
     url = url.strip()
+    m = _VIDEO_ID_RE.search(url)
+    if m:
+        return m.group(1) or m.group(2)
     if "youtube.com" in url or "youtu.be" in url:
-        parsed = urlparse(url)
-        qs = parse_qs(parsed.query)
-        if "v" in qs:
-            return qs["v"][0]
-        path_id = parsed.path.lstrip("/").split("/")[0]
-        if path_id:
-            return path_id
         raise ValueError("Could not extract video ID from URL.")
-    if re.match(r"^[A-Za-z0-9_-]{11}$", url):
-        return url
     raise ValueError("Invalid YouTube URL or video ID.")
 
 
@@ -68,6 +114,46 @@ def _yt_api() -> YouTubeTranscriptApi:
     return YouTubeTranscriptApi()
 
 
+@cache.memoize(expire=TITLE_TTL)
+def get_video_title(video_id: str) -> str:
+    watch_url = f"https://www.youtube.com/watch?v={video_id}"
+    resp = _http_session().get(
+        "https://www.youtube.com/oembed",
+        params={"url": watch_url, "format": "json"},
+        timeout=HTTP_TIMEOUT,
+    )
+    if resp.status_code == 401:
+        # oEmbed refuses videos with embedding disabled — fall back to the watch page
+        return _scrape_video_title(watch_url)
+    resp.raise_for_status()
+    return resp.json()["title"]
+
+
+def _scrape_video_title(watch_url: str) -> str:
+    # Stream the page and stop as soon as <title> arrives instead of downloading ~1MB
+    with _http_session().get(watch_url, stream=True, timeout=HTTP_TIMEOUT) as resp:
+        resp.raise_for_status()
+        resp.encoding = resp.encoding or "utf-8"
+        page = ""
+        pos = 0
+        for chunk in resp.iter_content(chunk_size=8192, decode_unicode=True):
+            page += chunk
+            m = _TITLE_RE.search(page, pos)
+            if m:
+                title = html.unescape(m.group(1)).removesuffix(" - YouTube").strip()
+                if title:
+                    return title
+                break
+            if len(page) >= _TITLE_SCAN_LIMIT:
+                break
+            # Resume from an unterminated <title>, or just before the chunk edge,
+            # so each chunk is scanned once
+            open_tag = page.rfind("<title>", pos)
+            pos = open_tag if open_tag != -1 else max(0, len(page) - len("<title>"))
+    raise RuntimeError(f"No <title> found on {watch_url}")
+
+
+@cache.memoize(expire=LANGUAGES_TTL)
 def list_available_languages(video_id: str) -> dict[str, str]:
     try:
         transcript_list = _yt_api().list(video_id)
@@ -90,13 +176,16 @@ def list_available_languages(video_id: str) -> dict[str, str]:
 
 
 def fetch_transcript(video_id: str, lang_code: str) -> list:
+    key = (video_id, lang_code)
+    hit = cache.get(key)
+    if hit is not None:
+        return hit
+
     try:
-        transcript_list = _yt_api().list(video_id)
-        try:
-            transcript = transcript_list.find_manually_created_transcript([lang_code])
-        except NoTranscriptFound:
-            transcript = transcript_list.find_generated_transcript([lang_code])
-        return transcript.fetch()
+        # find_transcript prefers a manual transcript and falls back to the
+        # auto-generated one, so a single list call covers both
+        transcript = _yt_api().list(video_id).find_transcript([lang_code])
+        entries = transcript.fetch().to_raw_data()
     except NoTranscriptFound:
         raise RuntimeError(f"No transcript found for '{lang_code}'. Try a different language.")
     except TranscriptsDisabled:
@@ -107,6 +196,9 @@ def fetch_transcript(video_id: str, lang_code: str) -> list:
         logger.exception("Unexpected error fetching transcript")
         raise RuntimeError(f"Failed to fetch transcript: {exc}") from exc
 
+    cache.set(key, entries, expire=TRANSCRIPT_TTL)
+    return entries
+
 
 def format_seconds(seconds: float) -> str:
     total = int(seconds)
@@ -115,11 +207,13 @@ def format_seconds(seconds: float) -> str:
     return f"{h}:{m:02d}:{s:02d}" if h else f"{m}:{s:02d}"
 
 
+# Field extraction for raw transcript dicts, done in C via map()
+entry_text = itemgetter("text")
+entry_start_text = itemgetter("start", "text")
+
+
 def entries_to_raw_text(entries: list) -> str:
-    return "".join(
-        (getattr(e, "text", None) or e.get("text", "")).strip()
-        for e in entries
-    )
+    return "".join(t.strip() for t in map(entry_text, entries))
 
 # ── Claude formatting ─────────────────────────────────────────────────────────
 
@@ -177,54 +271,99 @@ def format_with_claude(raw_text: str) -> str:
     placeholder.empty()
     return full_response
 
+
+def study_lines(formatted_text: str) -> list[str]:
+    # Split once; the docx and pdf builders both consume the same line list
+    return [line.strip() for line in formatted_text.strip().splitlines()]
+
 # ── DOCX builders ─────────────────────────────────────────────────────────────
 
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+# Pre-rendered WordprocessingML for the body paragraphs (sizes in half-points,
+# spacing in twentieths of a point): bold 9pt timestamps, 13pt study lines
+# with 6pt after.
+_TIMESTAMP_RPR = '<w:rPr><w:b/><w:sz w:val="18"/></w:rPr>'
+_STUDY_RPR = '<w:rPr><w:sz w:val="26"/></w:rPr>'
+_STUDY_PPR = '<w:pPr><w:spacing w:after="120"/></w:pPr>'
+
+
+def _run_xml(text: str, rpr: str = "") -> str:
+    # Same text handling as Run.text: tabs and newlines become <w:tab/> / <w:br/>
+    body = (
+        escape(text)
+        .replace("\t", '</w:t><w:tab/><w:t xml:space="preserve">')
+        .replace("\n", '</w:t><w:br/><w:t xml:space="preserve">')
+    )
+    return f'<w:r>{rpr}<w:t xml:space="preserve">{body}</w:t></w:r>'
+
+
+def _append_paragraphs(doc: DocxDocument, paragraphs: list[str]) -> None:
+    # One XML parse for the whole body instead of an add_paragraph() per line
+    frag = parse_xml(f"<w:body {nsdecls('w')}>{''.join(paragraphs)}</w:body>")
+    sect_pr = doc.element.body.sectPr
+    for p in list(frag):
+        sect_pr.addprevious(p)
+
+
+# python-docx's default template, read once per process rather than on every rerun
+@st.cache_resource
+def _docx_template() -> bytes:
+    return (Path(docx.__file__).parent / "templates" / "default.docx").read_bytes()
+
+
+def _new_document() -> DocxDocument:
+    return Document(io.BytesIO(_docx_template()))
+
+
+def _docx_bytes(doc: DocxDocument) -> bytes:
+    # Serialise in memory — nothing touches the filesystem on the request path
+    buf = io.BytesIO()
+    doc.save(buf)
+    return buf.getvalue()
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
 def build_raw_docx(entries: list, title: str, include_timestamps: bool) -> bytes:
-    doc = Document()
+    doc = _new_document()
     heading = doc.add_heading(title, level=1)
     heading.alignment = WD_ALIGN_PARAGRAPH.LEFT
     doc.add_paragraph()
 
-    for entry in entries:
-        text = (getattr(entry, "text", None) or entry.get("text", "")).strip()
-        start = getattr(entry, "start", None) or entry.get("start", 0)
+    paragraphs = []
+    for start, text in map(entry_start_text, entries):
+        text = text.strip()
         if include_timestamps:
-            p = doc.add_paragraph()
-            ts = p.add_run(f"[{format_seconds(start)}]  ")
-            ts.bold = True
-            ts.font.size = Pt(9)
-            p.add_run(text)
+            ts = _run_xml(f"[{format_seconds(start)}]  ", _TIMESTAMP_RPR)
+            paragraphs.append(f"<w:p>{ts}{_run_xml(text)}</w:p>")
         else:
-            doc.add_paragraph(text)
+            paragraphs.append(f"<w:p>{_run_xml(text)}</w:p>")
+    _append_paragraphs(doc, paragraphs)
 
-    buf = io.BytesIO()
-    doc.save(buf)
-    return buf.getvalue()
+    return _docx_bytes(doc)
 
 
-def build_study_docx(formatted_text: str, title: str) -> bytes:
-    doc = Document()
+@st.cache_data(ttl=3600, show_spinner=False)
+def build_study_docx(lines: list[str], title: str) -> bytes:
+    doc = _new_document()
     heading = doc.add_heading(title + " — Study Edition", level=1)
     heading.alignment = WD_ALIGN_PARAGRAPH.LEFT
     doc.add_paragraph()
 
-    for line in formatted_text.strip().splitlines():
-        line = line.strip()
+    paragraphs = []
+    for line in lines:
         if not line:
-            doc.add_paragraph()
+            paragraphs.append("<w:p/>")
             continue
-        p = doc.add_paragraph()
-        run = p.add_run(line)
-        run.font.size = Pt(13)
-        p.paragraph_format.space_after = Pt(6)
+        paragraphs.append(f"<w:p>{_STUDY_PPR}{_run_xml(line, _STUDY_RPR)}</w:p>")
+    _append_paragraphs(doc, paragraphs)
 
-    buf = io.BytesIO()
-    doc.save(buf)
-    return buf.getvalue()
+    return _docx_bytes(doc)
 
 # ── PDF builder ───────────────────────────────────────────────────────────────
 
-def build_study_pdf(formatted_text: str, title: str) -> bytes:
+@st.cache_data(ttl=3600, show_spinner=False)
+def build_study_pdf(lines: list[str], title: str) -> bytes:
     buf = io.BytesIO()
     doc = SimpleDocTemplate(
         buf,
@@ -250,10 +389,9 @@ def build_study_pdf(formatted_text: str, title: str) -> bytes:
         spaceAfter=8,
     )
 
-    story = [Paragraph(title + " — Study Edition", title_style), Spacer(1, 6 * mm)]
+    story = [Paragraph(escape(title) + " — Study Edition", title_style), Spacer(1, 6 * mm)]
 
-    for line in formatted_text.strip().splitlines():
-        line = line.strip()
+    for line in lines:
         if not line:
             story.append(Spacer(1, 4 * mm))
         else:
@@ -262,6 +400,32 @@ def build_study_pdf(formatted_text: str, title: str) -> bytes:
     doc.build(story)
     return buf.getvalue()
 
+# ── Cached pipeline ───────────────────────────────────────────────────────────
+
+def video_title(video_id: str) -> str:
+    try:
+        return get_video_title(video_id)
+    except Exception:
+        logger.warning("Could not fetch title for %s", video_id, exc_info=True)
+        return f"Video_{video_id}"
+
+
+def safe_filename(title: str) -> str:
+    if _ILLEGAL_FN_CHARS.isdisjoint(title):
+        return title
+    return title.translate(_FN_SANITIZE)
+
+
+# Reruns with the same inputs serve the transcript and preview from memory
+@st.cache_data(ttl=3600, show_spinner=False)
+def build_raw_transcript(video_id: str, lang_code: str, include_timestamps: bool) -> tuple[list, str]:
+    entries = fetch_transcript(video_id, lang_code)
+    preview = "\n".join(
+        f"[{format_seconds(start)}] {text.strip()}" if include_timestamps else text.strip()
+        for start, text in map(entry_start_text, entries)
+    )
+    return entries, preview
+
 # ── UI ────────────────────────────────────────────────────────────────────────
 
 def main():
@@ -332,32 +496,38 @@ Get a key at [console.anthropic.com](https://console.anthropic.com)
 
     # ── Step 4: Generate ───────────────────────────────────────────────────
     if st.button("Generate Transcript", disabled=(not lang_code)):
+        # Title and transcript are independent network calls — overlap them.
+        # The title lookup stays outside st.cache_data so a failed lookup's
+        # fallback is never cached.
+        ex = ThreadPoolExecutor(max_workers=1)
         with st.spinner("Fetching transcript…"):
+            f_title = ex.submit(video_title, video_id)
             try:
-                entries = fetch_transcript(video_id, lang_code)
+                entries, raw_preview = build_raw_transcript(video_id, lang_code, include_timestamps)
             except RuntimeError as exc:
+                # Don't hold the script on a title lookup that won't be used
+                ex.shutdown(wait=False, cancel_futures=True)
                 st.error(f"❌ {exc}")
                 return
+            title = f_title.result()
+            ex.shutdown()
 
         st.success(f"✅ Fetched {len(entries)} transcript entries.")
-        safe_title = re.sub(r'[\\/*?:"<>|]', "_", f"Video_{video_id}")
+        safe_title = safe_filename(title)
 
         # ── Raw transcript ─────────────────────────────────────────────
         with st.expander("📝 Raw Transcript", expanded=not study_mode):
-            preview_lines = []
-            for e in entries:
-                start = getattr(e, "start", None) or e.get("start", 0)
-                text = (getattr(e, "text", None) or e.get("text", "")).strip()
-                ts = f"[{format_seconds(start)}] " if include_timestamps else ""
-                preview_lines.append(f"{ts}{text}")
-            st.text_area("Raw transcript text", "\n".join(preview_lines), height=250, label_visibility="collapsed")
-
-        raw_docx = build_raw_docx(entries, safe_title, include_timestamps)
+            st.text_area("Raw transcript text", raw_preview, height=250, label_visibility="collapsed")
+
+        # Documents are only serialised when their download button is clicked.
+        # on_click="ignore" skips the rerun, which would otherwise drop these
+        # buttons (they only exist under the Generate button) and their callables.
         st.download_button(
             label="📥 Download raw .docx",
-            data=raw_docx,
+            data=lambda: build_raw_docx(entries, title, include_timestamps),
             file_name=f"{safe_title}_raw.docx",
-            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+            mime=DOCX_MIME,
+            on_click="ignore",
         )
 
         # ── Study version ──────────────────────────────────────────────
@@ -375,26 +545,27 @@ Get a key at [console.anthropic.com](https://console.anthropic.com)
                 return
 
             st.text_area("📖 Formatted Transcript", formatted, height=400)
+            lines = study_lines(formatted)
 
             # Download buttons side by side
             dl_col1, dl_col2 = st.columns(2)
 
             with dl_col1:
-                study_docx = build_study_docx(formatted, safe_title)
                 st.download_button(
                     label="📥 Download study .docx",
-                    data=study_docx,
+                    data=lambda: build_study_docx(lines, title),
                     file_name=f"{safe_title}_study.docx",
-                    mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                    mime=DOCX_MIME,
+                    on_click="ignore",
                 )
 
             with dl_col2:
-                study_pdf = build_study_pdf(formatted, safe_title)
                 st.download_button(
                     label="📥 Download study .pdf",
-                    data=study_pdf,
+                    data=lambda: build_study_pdf(lines, title),
                     file_name=f"{safe_title}_study.pdf",
                     mime="application/pdf",
+                    on_click="ignore",
                 )
 
 
@@ -0,0 +1,42 @@
+import pytest
+
+from streamlit_app import extract_video_id
+
+VIDEO_ID = "dQw4w9WgXcQ"
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        VIDEO_ID,
+        f"https://www.youtube.com/watch?v={VIDEO_ID}",
+        f"youtube.com/watch?feature=share&v={VIDEO_ID}&t=3",
+        f"https://youtube.com/watch/?v={VIDEO_ID}",
+        f"https://m.youtube.com/watch?v={VIDEO_ID}",
+        f"https://music.youtube.com/watch?v={VIDEO_ID}&list=RD",
+        f"https://gaming.youtube.com/watch?v={VIDEO_ID}",
+        f"https://youtu.be/{VIDEO_ID}?t=1",
+        f"https://www.youtube.com/embed/{VIDEO_ID}#t=5",
+        f"https://youtube.com/shorts/{VIDEO_ID}/",
+        f"https://www.youtube.com/live/{VIDEO_ID}?feature=share",
+        f"https://www.youtube.com/v/{VIDEO_ID}",
+    ],
+)
+def test_extracts_id(url):
+    assert extract_video_id(url) == VIDEO_ID
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        f"https://youtu.be/{VIDEO_ID}extra",
+        f"https://www.youtube.com/watch?v={VIDEO_ID}%26",
+        f"https://example.com/?x=youtu.be/{VIDEO_ID}",
+        f"https://notyoutube.com/watch?v={VIDEO_ID}",
+        "https://www.youtube.com/",
+        "not a video",
+    ],
+)
+def test_rejects_invalid(url):
+    with pytest.raises(ValueError):
+        extract_video_id(url)